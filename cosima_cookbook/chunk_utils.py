@@ -0,0 +1,44 @@
+# sizing of dask chunks for variables opened from the index
+
+# Range of the number of elements in a chunk: outside this, the native
+# chunks of a file are combined or split along their outermost dimension
+# (16 MB to 128 MB of float32 data)
+_min_chunk_size = 2**22
+_max_chunk_size = 2**25
+
+
+def _sized_chunks(chunks, fixed=()):
+    """Adjust chunking along the outermost dimension so that a chunk has
+    between _min_chunk_size and _max_chunk_size elements, where possible.
+
+    Small chunks are grown by whole native chunks, as very small native
+    chunks give dask graphs with a huge number of tasks. Large chunks are
+    split, so that selecting part of a file doesn't read all of it. Chunks
+    can't usefully be changed after the files are opened, so this is done
+    up front.
+
+    The chunking of dimensions in fixed (e.g. those chosen by the user) is
+    kept as it is, and only the outermost of the other dimensions is
+    adjusted. Nothing is adjusted if a chunk spans a whole dimension (None
+    or -1), as the size of a chunk isn't known then.
+    """
+
+    if not chunks:
+        return chunks
+
+    size = 1
+    for chunk in chunks.values():
+        if not isinstance(chunk, int) or chunk < 1:
+            return chunks
+        size *= chunk
+
+    outer = next((dim for dim in chunks if dim not in fixed), None)
+    if outer is None:
+        return chunks
+
+    if size < _min_chunk_size:
+        chunks[outer] *= -(-_min_chunk_size // size)
+    elif size > _max_chunk_size:
+        chunks[outer] = max(1, chunks[outer] * _max_chunk_size // size)
+
+    return chunks
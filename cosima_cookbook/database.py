@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 import os
@@ -479,11 +480,16 @@ class CFVariable(UniqueMixin, Base):
 
 class NCVar(Base):
     __tablename__ = "ncvars"
+    # allows looking up a given variable within each file directly; as
+    # ncfile_id leads, this also serves lookups of all variables in a file
+    __table_args__ = (
+        Index("ix_ncvars_ncfile_id_variable_id", "ncfile_id", "variable_id"),
+    )
 
     id = Column(Integer, primary_key=True)
 
     #: The ncfile to which this variable belongs
-    ncfile_id = Column(Integer, ForeignKey("ncfiles.id"), nullable=False, index=True)
+    ncfile_id = Column(Integer, ForeignKey("ncfiles.id"), nullable=False)
     ncfile = relationship("NCFile", back_populates="ncvars")
     #: The generic form of this variable (name and attributes)
     variable_id = Column(Integer, ForeignKey("variables.id"), nullable=False)
@@ -536,6 +542,16 @@ def create_session(db=None, debug=False, timeout=15):
         "sqlite:///" + str(db_path), echo=debug, connect_args={"timeout": timeout}
     )
 
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # larger page cache (128 MB), in-memory temporary tables for sorting
+        # and grouping, and memory-mapped reads (256 MB) for querying
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA cache_size=-131072")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
     # if database version is 0, we've created it anew
     conn = engine.connect()
     ver = conn.execute("PRAGMA user_version").fetchone()[0]
@@ -890,14 +906,22 @@ def _prune_files(expt, session, files, delete=True):
     # Find ids of all files newer than the time last indexed. Only valid
     # for delete=True as entries cannot be updated if they already exist
     # in the DB
-    oldids = [
-        f.id
+    indexed = [
+        (f.id, f.index_time, f.ncfile_path)
         for f in (
             session.query(NCFile)
             .with_parent(expt)
             .filter(NCFile.ncfile.in_(files) & (NCFile.present == True))
         )
-        if f.index_time < datetime.fromtimestamp(f.ncfile_path.stat().st_mtime)
+    ]
+    # stat files concurrently, as each one may be a round trip to a
+    # networked filesystem
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        mtimes = list(executor.map(lambda f: f[2].stat().st_mtime, indexed))
+    oldids = [
+        ncfile_id
+        for (ncfile_id, index_time, _), mtime in zip(indexed, mtimes)
+        if index_time < datetime.fromtimestamp(mtime)
     ]
     if not delete:
         oldids = []
@@ -921,7 +945,7 @@ def _prune_files(expt, session, files, delete=True):
 
     session.expire_all()
     if delete:
-        missing_ncfiles.delete(synchronize_session=False)
+        missing_ncfiles.delete(synchronize_session="fetch")
     else:
         missing_ncfiles.update({NCFile.present: False}, synchronize_session=False)
 
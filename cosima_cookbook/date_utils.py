@@ -37,8 +37,17 @@ def date2num_round(dates, units, calendar):
 
 
 def rebase_times(values, input_units, calendar, output_units):
-    dates = num2date(values, input_units, calendar)
-    return date2num_round(dates, output_units, calendar)
+    # Within a calendar, converting between time units is a linear
+    # transformation, so work out its offset and scale once rather than
+    # converting every value to a date and back
+    def unit_length(units):
+        return (
+            num2date(1, units, calendar) - num2date(0, units, calendar)
+        ).total_seconds()
+
+    offset = date2num(num2date(0, input_units, calendar), output_units, calendar)
+    scale = unit_length(input_units) / unit_length(output_units)
+    return np.round(values * scale + offset, 8)
 
 
 def is_bounds(var):
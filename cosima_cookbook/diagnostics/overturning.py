@@ -256,12 +256,13 @@ def zonal_mean(expt, variable, n=10, resolution=1):
     else:
         print("WARNING: Sorry, we dont seem to recognise resolution ", resolution)
 
-    zonal_WOA13.compute()
+    zonal_WOA13 = zonal_WOA13.compute()
     if variable == "temp":
         zonal_WOA13 = zonal_WOA13 + 273.15
 
-    zonal_mean = zonal_var.mean("xt_ocean").mean("time")
-    zonal_mean.compute()
+    # reduce over both dimensions in one pass, and keep the computed result
+    # so that only the reduced array is cached and returned
+    zonal_mean = zonal_var.mean(("xt_ocean", "time")).compute()
     zonal_diff = zonal_mean - zonal_WOA13.values
 
     return zonal_mean, zonal_diff
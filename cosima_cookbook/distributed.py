@@ -1,4 +1,5 @@
 import os, socket, getpass
+import dask
 from distributed import Client, LocalCluster
 
 from itertools import product
@@ -41,6 +42,20 @@ def start_cluster(diagnostics_port=0):
     return client
 
 
+def configure_scheduler(n_workers=None, file_cache_maxsize=256):
+    """Use one threaded scheduler with n_workers threads for all dask
+    computations (including opening files in getvar), and keep up to
+    file_cache_maxsize netCDF files open between calls.
+
+    This is an alternative to start_cluster, and should not be used while
+    a distributed client is active, as it would replace the client as the
+    default scheduler.
+    """
+
+    dask.config.set(scheduler="threads", num_workers=n_workers)
+    xr.set_options(file_cache_maxsize=file_cache_maxsize)
+
+
 def compute_by_block(dsx):
     """ """
 
@@ -6,6 +6,7 @@ __all__ = [
     "build_index",
 ]
 
+import ast
 import netCDF4
 import re
 import os
@@ -25,6 +26,7 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 from .date_utils import rebase_dataset
+from .chunk_utils import _sized_chunks
 
 
 def database_url_from_path(path):
@@ -459,8 +461,12 @@ def get_nc_variable(
 
         # print('Found {} ncfiles'.format(len(ncfiles)))
 
-        dimensions = eval(rows[0]["dimensions"])
-        chunking = eval(rows[0]["chunking"])
+        dimensions = ast.literal_eval(rows[0]["dimensions"])
+        try:
+            chunking = ast.literal_eval(rows[0]["chunking"])
+        except (ValueError, SyntaxError):
+            # chunking could be 'contiguous', which isn't a literal
+            chunking = None
 
         # print ('chunking info', dimensions, chunking)
         if chunking is not None:
@@ -470,7 +476,9 @@ def get_nc_variable(
 
         if chunks is not None:
             default_chunks.update(chunks)
-            chunks = default_chunks
+            # grow tiny on-disk chunks so the dask graph doesn't have a huge
+            # number of tasks, along the dimensions not chosen by the caller
+            chunks = _sized_chunks(default_chunks, fixed=chunks)
 
         if n is not None:
             # print('using last {} ncfiles only'.format(n))
@@ -486,19 +494,16 @@ def get_nc_variable(
         logging.debug(f"Opening {len(ncfiles)} ncfiles...")
 
         if use_bag:
-            bag = dask.bag.from_sequence(ncfiles)
-
-            load_variable = lambda ncfile: xr.open_dataset(
-                ncfile, chunks=chunks, decode_times=False
-            )[variables]
-            # bag = bag.map(load_variable, chunks, time_units, variables)
-            bag = bag.map(load_variable)
-
-            dataarrays = bag.compute()
-            dataarray = xr.concat(
-                dataarrays,
-                dim="time",
-                coords="all",
+            # open the files in parallel and concatenate them lazily, rather
+            # than computing a list of datasets up front
+            dataarray = xr.open_mfdataset(
+                ncfiles,
+                parallel=True,
+                combine="nested",
+                concat_dim="time",
+                chunks=chunks,
+                decode_times=False,
+                preprocess=lambda d: d[variables],
             )
             dataarray = decode_time(dataarray, time_units, offset)
         else:
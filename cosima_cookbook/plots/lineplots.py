@@ -1,7 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import matplotlib.pyplot as plt
 import cosima_cookbook as cc
-from tqdm import tqdm_notebook
-import IPython.display
+
+# results of diagnostics already computed in this session, keyed on
+# the diagnostic name and its arguments
+_diag_cache = {}
+
+
+def _cached(func, *args):
+    """
+    Return func(*args), reusing the result of any previous call with the
+    same arguments in this session.
+    """
+
+    key = (
+        func.__name__,
+        tuple(tuple(a) if isinstance(a, list) else a for a in args),
+    )
+    if key not in _diag_cache:
+        _diag_cache[key] = func(*args)
+
+    return _diag_cache[key]
+
+
+def _maybe_tqdm(iterable, **kwargs):
+    """
+    Wrap iterable in a notebook progress bar, unless it is too short
+    for the progress bar to be worth its overhead.
+    """
+
+    if len(iterable) < 4:
+        return iterable
+
+    from tqdm import tqdm_notebook
+
+    return tqdm_notebook(iterable, **kwargs)
+
+
+def _cached_all(func, expts, *args):
+    """
+    Return [_cached(func, expt, *args) for expt in expts], computing the
+    experiments concurrently. The diagnostics are dominated by reading
+    data, which releases the GIL, so threads are sufficient. This is safe
+    because the data is read through xarray, whose lock serialises calls
+    into the (not thread-safe) netCDF/HDF5 library itself.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(expts), 8))) as executor:
+        futures = [executor.submit(_cached, func, expt, *args) for expt in expts]
+        return [
+            future.result()
+            for future in _maybe_tqdm(futures, leave=False, desc="experiments")
+        ]
+
+
+def clear_plot_cache():
+    """
+    Discard all diagnostics cached by the plotting functions.
+    """
+
+    _diag_cache.clear()
 
 
 def wind_stress(expts=[]):
@@ -14,13 +73,15 @@ def wind_stress(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        result = {"mean_tau_x": cc.diagnostics.mean_tau_x(expt), "expt": expt}
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        result = {"mean_tau_x": _cached(cc.diagnostics.mean_tau_x, expt), "expt": expt}
         results.append(result)
 
     IPython.display.clear_output()
@@ -51,6 +112,8 @@ def annual_scalar(expts=[], variables=[]):
         Variable name(s).
     """
 
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
@@ -59,8 +122,10 @@ def annual_scalar(expts=[], variables=[]):
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        annual_average = cc.diagnostics.annual_scalar(expt, variables)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        # all variables are loaded together, so each experiment's files
+        # are only opened once
+        annual_average = _cached(cc.diagnostics.annual_scalar, expt, variables)
 
         result = {"annual_average": annual_average, "expt": expt}
         results.append(result)
@@ -71,13 +136,16 @@ def annual_scalar(expts=[], variables=[]):
     for variable in variables:
         plt.figure(figsize=(12, 6))
 
+        # the title is the same for every experiment, so only look it up once
+        long_name = results[0]["annual_average"][variable].long_name
+
         for result in results:
             annual_average = result["annual_average"]
             expt = result["expt"]
 
             annual_average[variable].plot(label=expt)
 
-        plt.title(annual_average[variable].long_name)
+        plt.title(long_name)
         plt.legend(fontsize=10, bbox_to_anchor=(1, 1), loc="best", borderaxespad=0.0)
 
         plt.xlabel("Time")
@@ -93,6 +161,8 @@ def drake_passage(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     plt.figure(figsize=(12, 6))
 
     if not isinstance(expts, list):
@@ -100,8 +170,8 @@ def drake_passage(expts=[]):
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        transport = cc.diagnostics.drake_passage(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        transport = _cached(cc.diagnostics.drake_passage, expt)
 
         result = {"transport": transport, "expt": expt}
         results.append(result)
@@ -130,13 +200,15 @@ def bering_strait(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     plt.figure(figsize=(12, 6))
 
     if not isinstance(expts, list):
         expts = [expts]
 
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        transport = cc.diagnostics.bering_strait(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        transport = _cached(cc.diagnostics.bering_strait, expt)
         transport.plot(label=expt)
 
     IPython.display.clear_output()
@@ -157,13 +229,15 @@ def aabw(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     plt.figure(figsize=(12, 6))
 
     if not isinstance(expts, list):
         expts = [expts]
 
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        psi_aabw = cc.diagnostics.calc_aabw(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        psi_aabw = _cached(cc.diagnostics.calc_aabw, expt)
         psi_aabw.plot(label=expt)
 
     IPython.display.clear_output()
@@ -184,13 +258,15 @@ def amoc(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     plt.figure(figsize=(12, 6))
 
     if not isinstance(expts, list):
         expts = [expts]
 
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        psi_amoc = cc.diagnostics.calc_amoc(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        psi_amoc = _cached(cc.diagnostics.calc_amoc, expt)
         psi_amoc.plot(label=expt)
 
     IPython.display.clear_output()
@@ -211,13 +287,15 @@ def amoc_south(expts=[]):
         Experiment name(s).
     """
 
+    import IPython.display
+
     plt.figure(figsize=(12, 6))
 
     if not isinstance(expts, list):
         expts = [expts]
 
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        psi_amoc_south = cc.diagnostics.calc_amoc_south(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        psi_amoc_south = _cached(cc.diagnostics.calc_amoc_south, expt)
         psi_amoc_south.plot(label=expt)
 
     IPython.display.clear_output()
@@ -1,8 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import dask
+import matplotlib
 import matplotlib.pyplot as plt
 import cosima_cookbook as cc
-from tqdm import tqdm_notebook
 
-import IPython.display
+from .lineplots import _cached, _maybe_tqdm
+
+# maps with more points than this are coarsened before plotting, as they
+# have more cells than can be resolved in the figure anyway
+_max_map_size = 2_000_000
+
+# let matplotlib place cell edges midway between the coordinates,
+# rather than having xarray infer them
+_map_kwargs = {"infer_intervals": False, "shading": "nearest"}
+
+# most processes used to render maps in parallel
+_max_render_workers = 4
+
+
+def _coarsen(data):
+    """
+    Halve the resolution of data along each dimension until it has no
+    more than _max_map_size points.
+    """
+
+    while data.size > _max_map_size:
+        data = data.coarsen({dim: 2 for dim in data.dims}, boundary="trim").mean()
+
+    return data
+
+
+def _plot_panels(panels, axes):
+    """
+    Plot panels into a row of axes, where panels is a list of
+    (data, title, plot kwargs) tuples.
+    """
+
+    for ax, (data, title, kwargs) in zip(axes, panels):
+        _coarsen(data).plot.pcolormesh(ax=ax, **_map_kwargs, **kwargs)
+        ax.set_title(title)
+
+
+def _render_png(panels, figsize):
+    """
+    Render panels (see _plot_panels) to a PNG image, returned as bytes.
+    """
+
+    matplotlib.use("Agg")
+    fig, axes = plt.subplots(1, len(panels), figsize=figsize, squeeze=False)
+    _plot_panels(panels, axes[0])
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+
+    return buf.getvalue()
+
+
+def _in_kernel():
+    """
+    Return whether we're running inside an IPython kernel, e.g. a notebook.
+    """
+
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return False
+
+    return getattr(get_ipython(), "kernel", None) is not None
+
+
+def _show_maps(figures, figsize):
+    """
+    Plot a row of panels for each list of panels in figures (see
+    _plot_panels), where figsize is the size of each row.
+
+    All rows are plotted in a single figure. When running in an IPython
+    kernel with the non-interactive Agg backend, rows are instead rendered
+    to PNG in separate processes and displayed as images, in order.
+    """
+
+    if not figures:
+        return
+
+    if matplotlib.get_backend().lower() != "agg" or not _in_kernel():
+        width, height = figsize
+        fig, axes = plt.subplots(
+            len(figures),
+            max(len(panels) for panels in figures),
+            figsize=(width, height * len(figures)),
+            squeeze=False,
+        )
+        for row, panels in zip(axes, figures):
+            _plot_panels(panels, row)
+        return
+
+    import IPython.display
+
+    # load the (coarsened) data here, so that it is computed once with the
+    # user's scheduler, and the worker processes only have to plot it
+    figures = [
+        [(_coarsen(data), title, kwargs) for data, title, kwargs in panels]
+        for panels in figures
+    ]
+    (figures,) = dask.compute(figures)
+
+    workers = min(len(figures), _max_render_workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pngs = executor.map(_render_png, figures, [figsize] * len(figures))
+        for png in pngs:
+            IPython.display.display(IPython.display.Image(data=png, format="png"))
 
 
 def sea_surface_temperature(expts=[], resolution=1):
@@ -10,13 +119,15 @@ def sea_surface_temperature(expts=[], resolution=1):
     Plot a map of SST from last decade of run.
     """
 
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        SST, SSTdiff = cc.diagnostics.sea_surface_temperature(expt, resolution)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        SST, SSTdiff = _cached(cc.diagnostics.sea_surface_temperature, expt, resolution)
 
         result = {"SST": SST, "SSTdiff": SSTdiff, "expt": expt}
         results.append(result)
@@ -24,18 +135,15 @@ def sea_surface_temperature(expts=[], resolution=1):
     IPython.display.clear_output()
 
     # plotting
+    figures = []
     for result in results:
         SST = result["SST"]
         SSTdiff = result["SSTdiff"]
         expt = result["expt"]
 
-        plt.figure(figsize=(12, 4))
-        plt.subplot(121)
-        SST.plot()
-        plt.title(expt)
-        plt.subplot(122)
-        SSTdiff.plot(robust=True)
-        plt.title(expt)
+        figures.append([(SST, expt, {}), (SSTdiff, expt, {"robust": True})])
+
+    _show_maps(figures, figsize=(12, 4))
 
 
 def sea_surface_salinity(expts=[], resolution=1):
@@ -43,13 +151,15 @@ def sea_surface_salinity(expts=[], resolution=1):
     Plot a map of SSS from last decade of run.
     """
 
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        SSS, SSSdiff = cc.diagnostics.sea_surface_salinity(expt, resolution)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        SSS, SSSdiff = _cached(cc.diagnostics.sea_surface_salinity, expt, resolution)
 
         result = {"SSS": SSS, "SSSdiff": SSSdiff, "expt": expt}
         results.append(result)
@@ -57,18 +167,15 @@ def sea_surface_salinity(expts=[], resolution=1):
     IPython.display.clear_output()
 
     # plotting
+    figures = []
     for result in results:
         SSS = result["SSS"]
         SSSdiff = result["SSSdiff"]
         expt = result["expt"]
 
-        plt.figure(figsize=(12, 4))
-        plt.subplot(121)
-        SSS.plot()
-        plt.title(expt)
-        plt.subplot(122)
-        SSSdiff.plot(robust=True)
-        plt.title(expt)
+        figures.append([(SSS, expt, {}), (SSSdiff, expt, {"robust": True})])
+
+    _show_maps(figures, figsize=(12, 4))
 
 
 def mixed_layer_depth(expts=[]):
@@ -76,13 +183,15 @@ def mixed_layer_depth(expts=[]):
     Plot a map of MLD from last decade of run.
     """
 
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
     results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        MLD = cc.diagnostics.mixed_layer_depth(expt)
+    for expt in _maybe_tqdm(expts, leave=False, desc="experiments"):
+        MLD = _cached(cc.diagnostics.mixed_layer_depth, expt)
 
         result = {"MLD": MLD, "expt": expt}
         results.append(result)
@@ -90,10 +199,6 @@ def mixed_layer_depth(expts=[]):
     IPython.display.clear_output()
 
     # plotting
-    for result in results:
-        MLD = result["MLD"]
-        expt = result["expt"]
+    figures = [[(result["MLD"], result["expt"], {})] for result in results]
 
-        plt.figure(figsize=(6, 4))
-        MLD.plot()
-        plt.title(expt)
+    _show_maps(figures, figsize=(6, 4))
@@ -1,51 +1,52 @@
 import cosima_cookbook as cc
 import matplotlib.pyplot as plt
+from matplotlib.colors import BoundaryNorm
 import numpy as np
-from tqdm import tqdm_notebook
 
-import IPython.display
+from .lineplots import _cached_all
 
 
 def psi_avg(expts, n=10, clev=np.arange(-20, 20, 2)):
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
-    results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        psi_avg = cc.diagnostics.psi_avg(expt, n)
-
-        result = {"psi_avg": psi_avg, "expt": expt}
-        results.append(result)
+    results = [
+        {"psi_avg": psi_avg, "expt": expt}
+        for psi_avg, expt in zip(_cached_all(cc.diagnostics.psi_avg, expts, n), expts)
+    ]
 
     IPython.display.clear_output()
 
-    # plotting
-    for result in results:
+    if not results:
+        return
+
+    # plotting, with one row of a single figure per experiment
+    fig, axes = plt.subplots(
+        len(results), 1, figsize=(10, 5 * len(results)), squeeze=False
+    )
+    for result, ax in zip(results, axes[:, 0]):
         psi_avg = result["psi_avg"]
         expt = result["expt"]
 
-        plt.figure(figsize=(10, 5))
-        plt.contourf(
+        # shade the levels directly on the regular grid, rather than
+        # finding every contour; only the zero line is drawn
+        mesh = ax.pcolormesh(
             psi_avg.grid_yu_ocean,
             psi_avg.potrho,
             psi_avg,
             cmap=plt.cm.PiYG,
-            levels=clev,
-            extend="both",
+            norm=BoundaryNorm(clev, ncolors=plt.cm.PiYG.N, extend="both"),
+            shading="auto",
+        )
+        cb = fig.colorbar(
+            mesh, ax=ax, orientation="vertical", shrink=0.7, extend="both"
         )
-        cb = plt.colorbar(orientation="vertical", shrink=0.7)
 
         cb.ax.set_xlabel("Sv")
-        plt.contour(
-            psi_avg.grid_yu_ocean,
-            psi_avg.potrho,
-            psi_avg,
-            levels=clev,
-            colors="k",
-            linewidths=0.25,
-        )
-        plt.contour(
+        ax.contour(
             psi_avg.grid_yu_ocean,
             psi_avg.potrho,
             psi_avg,
@@ -55,45 +56,47 @@ def psi_avg(expts, n=10, clev=np.arange(-20, 20, 2)):
             colors="k",
             linewidths=0.5,
         )
-        plt.gca().invert_yaxis()
+        ax.invert_yaxis()
 
-        plt.ylim((1037.5, 1034))
-        plt.ylabel("Potential Density (kg m$^{-3}$)")
-        plt.xlabel("Latitude ($^\circ$N)")
-        plt.xlim([-75, 85])
-        plt.title("Overturning in %s" % expt)
+        ax.set_ylim((1037.5, 1034))
+        ax.set_ylabel("Potential Density (kg m$^{-3}$)")
+        ax.set_xlabel("Latitude ($^\circ$N)")
+        ax.set_xlim([-75, 85])
+        ax.set_title("Overturning in %s" % expt)
 
 
 def zonal_mean(expts, variable, n=10, resolution=1):
+    import IPython.display
+
     if not isinstance(expts, list):
         expts = [expts]
 
     # computing
-    results = []
-    for expt in tqdm_notebook(expts, leave=False, desc="experiments"):
-        zonal_mean, zonal_diff = cc.diagnostics.zonal_mean(
-            expt, variable, n, resolution
+    results = [
+        {"zonal_mean": zonal_mean, "zonal_diff": zonal_diff, "expt": expt}
+        for (zonal_mean, zonal_diff), expt in zip(
+            _cached_all(cc.diagnostics.zonal_mean, expts, variable, n, resolution),
+            expts,
         )
-
-        result = {"zonal_mean": zonal_mean, "zonal_diff": zonal_diff, "expt": expt}
-        results.append(result)
+    ]
 
     IPython.display.clear_output()
 
-    # plotting
-    for result in results:
+    if not results:
+        return
+
+    # plotting, with one row of a single figure per experiment
+    fig, axes = plt.subplots(
+        len(results), 2, figsize=(12, 5 * len(results)), squeeze=False
+    )
+    for result, (ax1, ax2) in zip(results, axes):
         zonal_mean = result["zonal_mean"]
         zonal_diff = result["zonal_diff"]
         expt = result["expt"]
 
-        plt.figure(figsize=(12, 5))
-        plt.subplot(121)
-        zonal_mean.plot()
-        plt.title(expt)
-        plt.gca().invert_yaxis()
-        plt.title("{}: Zonal Mean {}".format(expt, variable))
-        plt.subplot(122)
-        zonal_diff.plot()
-        plt.title(expt)
-        plt.gca().invert_yaxis()
-        plt.title("{}: Zonal Mean {} Change".format(expt, variable))
+        zonal_mean.plot(ax=ax1)
+        ax1.invert_yaxis()
+        ax1.set_title("{}: Zonal Mean {}".format(expt, variable))
+        zonal_diff.plot(ax=ax2)
+        ax2.invert_yaxis()
+        ax2.set_title("{}: Zonal Mean {} Change".format(expt, variable))
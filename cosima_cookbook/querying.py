@@ -4,10 +4,15 @@ Functions for data discovery.
 
 """
 
+import ast
+from collections import OrderedDict
+from functools import lru_cache
 import logging
 import os.path
+from pathlib import Path
 import pandas as pd
-from sqlalchemy import func, distinct, or_
+from types import MappingProxyType
+from sqlalchemy import func, distinct, and_, or_, event
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.selectable import subquery
 import warnings
@@ -16,6 +21,7 @@ import xarray as xr
 from . import database
 from .database import NCExperiment, NCFile, CFVariable, NCVar, Keyword
 from .database import NCAttribute, NCAttributeString
+from .chunk_utils import _sized_chunks
 
 
 class VariableNotFoundError(Exception):
@@ -29,6 +35,16 @@ class QueryWarning(UserWarning):
 # By default all ambiguous queries will raise an exception
 warnings.simplefilter("error", category=QueryWarning, lineno=0, append=False)
 
+# Attributes getvar requires to be unique unless told otherwise
+_default_attrs_unique = MappingProxyType({"cell_methods": "time: mean"})
+
+# Key in session.info under which query results are cached
+_session_cache_key = "cosima_cookbook.querying"
+
+# Recently opened datasets, for getvar(..., cache=True)
+_dataset_cache = OrderedDict()
+_dataset_cache_size = 16
+
 
 def get_experiments(
     session,
@@ -98,7 +114,7 @@ def get_experiments(
     if exptname is not None:
         q = q.filter(NCExperiment.experiment == exptname)
 
-    return pd.DataFrame(q, columns=[c["name"] for c in q.column_descriptions])
+    return _query_frame(session, q)
 
 
 def get_ncfiles(session, experiment):
@@ -113,7 +129,7 @@ def get_ncfiles(session, experiment):
         .order_by(NCFile.ncfile)
     )
 
-    return pd.DataFrame(q, columns=[c["name"] for c in q.column_descriptions])
+    return _query_frame(session, q)
 
 
 def get_keywords(session, experiment=None):
@@ -248,7 +264,7 @@ def get_variables(
         "restart": "boolean",
     }
 
-    df = pd.DataFrame(q, columns=[c["name"] for c in q.column_descriptions])
+    df = _query_frame(session, q)
 
     return df.astype({k: v for k, v in default_dtypes.items() if k in df.columns})
 
@@ -269,7 +285,20 @@ def get_frequencies(session, experiment=None):
             .group_by(NCFile.frequency)
         )
 
-    return pd.DataFrame(q, columns=[c["name"] for c in q.column_descriptions])
+    return _query_frame(session, q)
+
+
+def _query_frame(session, q):
+    """Return the results of a query as a DataFrame.
+
+    The query's statement is executed directly, so that rows are fetched
+    in one go rather than iterated through the ORM query.
+    """
+
+    columns = [c["name"] for c in q.column_descriptions]
+    rows = session.execute(q.statement).fetchall()
+
+    return pd.DataFrame.from_records(rows, columns=columns)
 
 
 def getvar(
@@ -284,6 +313,7 @@ def getvar(
     attrs=None,
     attrs_unique=None,
     return_dataset=False,
+    cache=False,
     **kwargs,
 ):
     """For a given experiment, return an xarray DataArray containing the
@@ -314,11 +344,17 @@ def getvar(
                      requested variable, along with its time_bounds,
                      if present.  Otherwise (default), return
                      xarray.DataArray containing only the variable
-
-    Note that if start_time and/or end_time are used, the time range
-    of the resulting dataset may not be bounded exactly on those
-    values, depending on where the underlying files start/end. Use
-    dataset.sel() to exactly select times from the dataset.
+    cache - if True, reuse the dataset from a recent call that opened the
+            same files with the same arguments, rather than opening them
+            again. Cached datasets are shared between calls, so they
+            should not be closed (e.g. by using getvar in a with statement)
+
+    Note that if start_time and/or end_time are used, data from files
+    that only partly overlap that range is restricted to it. Times can
+    only be selected once they are decoded, so with decode_times=False the
+    time range of the resulting dataset may not be bounded exactly on
+    those values, depending on where the underlying files start/end. Use
+    dataset.sel() to exactly select times from the dataset in that case.
 
     Other kwargs are passed through to xarray.open_mfdataset, including:
 
@@ -328,7 +364,7 @@ def getvar(
     """
 
     if attrs_unique is None:
-        attrs_unique = {"cell_methods": "time: mean"}
+        attrs_unique = _default_attrs_unique
 
     ncfiles = _ncfiles_for_variable(
         expt,
@@ -341,19 +377,81 @@ def getvar(
         frequency,
         attrs,
         attrs_unique,
+        columns=(
+            NCExperiment.root_dir,
+            NCFile.ncfile,
+            NCVar.id,
+            NCVar.dimensions,
+            NCVar.chunking,
+            NCFile.time_start,
+            NCFile.time_end,
+        ),
     )
 
     variables = [variable]
     if return_dataset:
         # we know at least one variable was returned, so we can index ncfiles
         # ask for the extra variables associated with cell_methods, etc.
-        variables += _bounds_vars_for_variable(*ncfiles[0])
+        ncvar = session.query(NCVar).get(ncfiles[0].id)
+        variables += _bounds_vars_for_variable(ncvar.ncfile, ncvar)
 
     # chunking -- use first row/file and assume it's the same across the whole dataset
-    xr_kwargs = {"chunks": _parse_chunks(ncfiles[0].NCVar)}
+    xr_kwargs = {"chunks": _sized_chunks(_parse_chunks(ncfiles[0]))}
+
+    # every file was opened with netCDF4 when it was indexed, so there's no
+    # need for xarray to sniff each file to choose a backend
+    xr_kwargs["engine"] = "netcdf4"
+    if ncfiles[-1].chunking != ncfiles[0].chunking:
+        logging.warning(
+            f"chunking of {variable} differs between {ncfiles[0].ncfile} "
+            f"and {ncfiles[-1].ncfile}. Pass chunks to getvar to choose "
+            "the chunking explicitly"
+        )
+
+    # files are already sorted by time, so time-varying data can be
+    # concatenated in order, rather than sorting and aligning every
+    # coordinate across files
+    time_dim = _find_time_coord(ast.literal_eval(ncfiles[0].dimensions))
+    nested = "combine" not in kwargs and time_dim is not None
+    if nested:
+        xr_kwargs.update(
+            combine="nested",
+            concat_dim=time_dim,
+            data_vars="minimal",
+            coords="minimal",
+            compat="override",
+        )
+    else:
+        xr_kwargs.update(
+            combine="by_coords",
+            data_vars="minimal",
+            coords="minimal",
+            compat="override",
+        )
+
     xr_kwargs.update(kwargs)
 
+    # files which are only partly within the requested time range, which
+    # are restricted to that range as they are opened
+    partial_files = {
+        os.path.abspath(Path(f.root_dir) / Path(f.ncfile))
+        for f in ncfiles
+        if (
+            start_time is not None
+            and f.time_start is not None
+            and f.time_start < start_time
+        )
+        or (end_time is not None and f.time_end is not None and f.time_end > end_time)
+    }
+
     def _preprocess(d):
+        source = os.path.abspath(d.encoding.get("source", ""))
+        decoded_time = isinstance(
+            d.indexes.get(time_dim), (pd.DatetimeIndex, xr.CFTimeIndex)
+        )
+        if source in partial_files and decoded_time:
+            d = d.sel({time_dim: slice(start_time, end_time)})
+
         if variable in d.coords:
             # just return coordinate data
             return d
@@ -362,15 +460,55 @@ def getvar(
         # like time_bounds
         return d[variables]
 
-    ncfiles = list(str(f.NCFile.ncfile_path) for f in ncfiles)
+    ncfiles = [str(Path(f.root_dir) / Path(f.ncfile)) for f in ncfiles]
 
-    ds = xr.open_mfdataset(
-        ncfiles,
-        parallel=True,
-        combine="by_coords",
-        preprocess=_preprocess,
-        **xr_kwargs,
-    )
+    if cache:
+        key = (
+            tuple(ncfiles),
+            variable,
+            tuple(variables),
+            start_time,
+            end_time,
+            tuple((k, repr(v)) for k, v in xr_kwargs.items()),
+        )
+        ds = _dataset_cache.get(key)
+    else:
+        ds = None
+
+    if ds is None:
+        ds = xr.open_mfdataset(
+            ncfiles,
+            parallel=True,
+            preprocess=_preprocess,
+            **xr_kwargs,
+        )
+
+        time_index = ds.indexes.get(time_dim) if nested else None
+        if time_index is not None and not (
+            time_index.is_monotonic_increasing and time_index.is_unique
+        ):
+            # files with overlapping or duplicated times (e.g. duplicated
+            # output directories) can't just be concatenated in order, so
+            # have xarray order them by their coordinates instead
+            del xr_kwargs["concat_dim"]
+            xr_kwargs["combine"] = "by_coords"
+            ds = xr.open_mfdataset(
+                ncfiles,
+                parallel=True,
+                preprocess=_preprocess,
+                **xr_kwargs,
+            )
+
+        if cache:
+            _dataset_cache[key] = ds
+            if len(_dataset_cache) > _dataset_cache_size:
+                _dataset_cache.popitem(last=False)
+    else:
+        _dataset_cache.move_to_end(key)
+
+    if cache:
+        # attributes are modified below, so don't share them with the cache
+        ds = ds.copy()
 
     if return_dataset:
         da = ds
@@ -387,24 +525,51 @@ def getvar(
                 f"chunking along dimensions {missing_chunk_dims} is not possible. Available dimensions for chunking are {set(da.dims)}"
             )
 
+    # Add experiment metadata to attributes
+    da.attrs.update(_experiment_metadata(session, expt))
+
     da.attrs["ncfiles"] = ncfiles
 
-    # Get experiment metadata, delete extraneous fields and add
-    # to attributes
-    metadata = get_experiments(
-        session, experiment=False, exptname=expt, all=True
-    ).to_dict(orient="records")[0]
-
-    metadata = {
-        k: v
-        for k, v in metadata.items()
-        if k not in ["ncfiles", "index", "root_dir"]
-        and (v is not None and v != "None" and v != "")
-    }
+    return da
 
-    da.attrs.update(metadata)
 
-    return da
+def _experiment_metadata(session, expt):
+    """Return a dictionary of the metadata fields that are set for an
+    experiment, for use as attributes.
+
+    The result is cached on the session, as getvar is often called many
+    times for the same experiment.
+    """
+
+    cache = _session_cache(session, "experiment_metadata")
+
+    if expt not in cache:
+        row = (
+            session.query(NCExperiment)
+            .filter(NCExperiment.experiment == expt)
+            .order_by(NCExperiment.id)
+            .first()
+        )
+
+        metadata = {}
+        for k in NCExperiment.metadata_keys:
+            # keywords aren't returned as metadata (see get_experiments)
+            if k == "keywords":
+                continue
+            v = getattr(row, k)
+            if v not in (None, "None", ""):
+                metadata[k] = v
+
+        cache[expt] = metadata
+
+    return cache[expt]
+
+
+def _find_time_coord(names):
+    """Return the name of the time dimension or coordinate among names,
+    matching case-insensitively (e.g. 'time' or 'Time'), or None."""
+
+    return {name.lower(): name for name in names}.get("time")
 
 
 def _bounds_vars_for_variable(ncfile, ncvar):
@@ -412,22 +577,24 @@ def _bounds_vars_for_variable(ncfile, ncvar):
 
     variables = []
 
-    if "cell_methods" not in ncvar.attrs:
-        # no cell methods, so no need to look for bounds
+    time_dim = _find_time_coord(ast.literal_eval(ncvar.dimensions))
+    if time_dim is None:
         return variables
 
     # [cell methods] is a string attribute comprising a list of
     # blank-separated words of the form "name: method"
-    cell_methods = iter(ncvar.attrs["cell_methods"].split())
+    cell_methods = ncvar.attrs.get("cell_methods", "").split()
 
     # for the moment, we're only looking for a time mean
-    for dim, method in zip(cell_methods, cell_methods):
-        if not (dim[:-1] == "time" and method == "mean"):
-            continue
+    try:
+        time_method = cell_methods[cell_methods.index(time_dim + ":") + 1]
+    except (ValueError, IndexError):
+        return variables
 
-    bounds_var = ncfile.ncvars["time"].attrs.get("bounds")
-    if bounds_var is not None:
-        variables.append(bounds_var)
+    if time_method == "mean" and time_dim in ncfile.ncvars:
+        bounds_var = ncfile.ncvars[time_dim].attrs.get("bounds")
+        if bounds_var is not None:
+            variables.append(bounds_var)
 
     return variables
 
@@ -443,6 +610,7 @@ def _ncfiles_for_variable(
     frequency=None,
     attrs=None,
     attrs_unique=None,
+    columns=None,
 ):
     """Return a list of (NCFile, NCVar) pairs corresponding to the
     database objects for a given variable.
@@ -450,6 +618,9 @@ def _ncfiles_for_variable(
     Optionally, pass ncfile, start_time, end_time, frequency, attrs,
     attrs_unique, or n for additional disambiguation (see getvar
     documentation for their semantics).
+
+    If columns is given, return rows containing only those columns
+    (of NCExperiment, NCFile or NCVar) rather than database objects.
     """
 
     if attrs is None:
@@ -463,10 +634,14 @@ def _ncfiles_for_variable(
         session.query(f, v)
         .join(f.ncvars)
         .join(f.experiment)
-        .filter(v.varname == variable)
+        .filter(
+            v.variable_id.in_(
+                session.query(CFVariable.id).filter(CFVariable.name == variable)
+            )
+        )
         .filter(database.NCExperiment.experiment == expt)
         .filter(f.present)
-        .order_by(f.time_start)
+        .order_by(f.time_start, f.ncfile)
     )
 
     # additional disambiguation
@@ -479,25 +654,40 @@ def _ncfiles_for_variable(
     if frequency is not None:
         q = q.filter(f.frequency == frequency)
 
-    # Attributes that are required to be unique to ensure disambiguation
-    for attr, val in attrs_unique.items():
-        # If default attribute present and not currently in filter
-        # add to attributes filter
-        if attr not in attrs:
-            if q.filter(v.ncvar_attrs.any(name=attr, value=val)).first():
-                attrs.update({attr: val})
+    # Attributes that are required to be unique to ensure disambiguation:
+    # if a default attribute is present and not currently in the filter,
+    # add it to the attributes filter
+    probes = {attr: val for attr, val in attrs_unique.items() if attr not in attrs}
+    if probes:
+        key = (
+            expt,
+            variable,
+            ncfile,
+            start_time,
+            end_time,
+            frequency,
+            frozenset(attrs.items()),
+            frozenset(probes.items()),
+        )
+        attrs.update(_unique_attrs_present(session, q, probes, key))
 
     # requested specific attribute values
     for attr, val in attrs.items():
         q = q.filter(v.ncvar_attrs.any(name=attr, value=val))
 
-    ncfiles = q.all()
+    # restrict to the first or last n files in the database, rather
+    # than loading every matching file and slicing afterwards
+    if n is not None and n > 0:
+        q = q.limit(n)
+    elif n is not None and n < 0:
+        q = q.order_by(None).order_by(f.time_start.desc(), f.ncfile.desc()).limit(-n)
 
-    if n is not None:
-        if n > 0:
-            ncfiles = ncfiles[:n]
-        else:
-            ncfiles = ncfiles[n:]
+    if columns is None:
+        ncfiles = q.all()
+    else:
+        ncfiles = session.execute(q.with_entities(*columns).statement).fetchall()
+    if n is not None and n < 0:
+        ncfiles.reverse()
 
     # ensure we actually got a result
     if not ncfiles:
@@ -507,14 +697,29 @@ def _ncfiles_for_variable(
             )
         )
 
-    # check whether the results are unique
+    # check whether the results are unique, finding the distinct values
+    # over the selected files in the database
+    selected = q.with_entities(
+        v.id.label("ncvar_id"), f.frequency.label("frequency")
+    ).subquery()
+
     for attr in attrs_unique:
-        unique_attributes = set()
-        for f in ncfiles:
-            if attr in f.NCVar.attrs:
-                unique_attributes.add(str(f.NCVar.attrs[attr]))
-            else:
-                unique_attributes.add(None)
+        ncas1 = aliased(NCAttributeString)
+        ncas2 = aliased(NCAttributeString)
+        attr_values = (
+            session.query(NCAttribute.ncvar_id, ncas2.value.label("value"))
+            .join(ncas1, NCAttribute.name_id == ncas1.id)
+            .join(ncas2, NCAttribute.value_id == ncas2.id)
+            .filter(ncas1.value == attr)
+        ).subquery()
+
+        # variables without the attribute give a None value
+        unique_attributes = {
+            value
+            for (value,) in session.query(distinct(attr_values.c.value))
+            .select_from(selected)
+            .outerjoin(attr_values, attr_values.c.ncvar_id == selected.c.ncvar_id)
+        }
         if len(unique_attributes) > 1:
             warnings.warn(
                 f"Your query returns variables from files with different {attr}: {unique_attributes}. "
@@ -523,7 +728,7 @@ def _ncfiles_for_variable(
                 QueryWarning,
             )
 
-    unique_freqs = set(f.NCFile.frequency for f in ncfiles)
+    unique_freqs = {freq for (freq,) in session.query(distinct(selected.c.frequency))}
     if len(unique_freqs) > 1:
         warnings.warn(
             f"Your query returns files with differing frequencies: {unique_freqs}. "
@@ -535,17 +740,85 @@ def _ncfiles_for_variable(
     return ncfiles
 
 
+def _session_cache(session, name):
+    """Return the dictionary in which the query results called name are
+    cached for session, which is kept with the session's other caches in
+    session.info.
+
+    The caches are cleared whenever the session commits, as the results may
+    be stale once the index is modified, e.g. by build_index.
+    """
+
+    caches = session.info.get(_session_cache_key)
+    if caches is None:
+        caches = session.info[_session_cache_key] = {}
+        event.listen(session, "after_commit", lambda session: caches.clear())
+
+    return caches.setdefault(name, {})
+
+
+def _unique_attrs_present(session, q, probes, key):
+    """Return the subset of the attribute name/value pairs in probes that
+    are present on any of the variables selected by the query q.
+
+    All pairs are probed in a single query, and the result is cached on the
+    session under key, which should identify the filters applied to q.
+    """
+
+    cache = _session_cache(session, "unique_attrs")
+
+    if key not in cache:
+        ncas1 = aliased(NCAttributeString)
+        ncas2 = aliased(NCAttributeString)
+        present = (
+            session.query(ncas1.value)
+            .select_from(NCAttribute)
+            .join(ncas1, NCAttribute.name_id == ncas1.id)
+            .join(ncas2, NCAttribute.value_id == ncas2.id)
+            .filter(
+                NCAttribute.ncvar_id.in_(
+                    q.with_entities(database.NCVar.id).order_by(None)
+                )
+            )
+            .filter(
+                or_(
+                    and_(ncas1.value == attr, ncas2.value == val)
+                    for attr, val in probes.items()
+                )
+            )
+            .distinct()
+        )
+        cache[key] = {attr: probes[attr] for (attr,) in present}
+
+    return cache[key]
+
+
 def _parse_chunks(ncvar):
     """Parse an NCVar, returning a dictionary mapping dimensions to chunking along that dimension."""
 
+    chunks = _parse_chunking(ncvar.chunking, ncvar.dimensions)
+    if chunks is None:
+        return None
+
+    return dict(chunks)
+
+
+@lru_cache(maxsize=256)
+def _parse_chunking(chunking, dimensions):
+    """Parse the chunking and dimensions strings of an NCVar, returning a
+    tuple of (dimension, chunk size) pairs, or None if the variable isn't chunked.
+
+    Most variables in an experiment share the same strings, so the result is cached.
+    """
+
     try:
         # this should give either a list, or 'None' (other values will raise an exception)
-        var_chunks = eval(ncvar.chunking)
-        if var_chunks is not None:
-            return dict(zip(eval(ncvar.dimensions), var_chunks))
-
+        var_chunks = ast.literal_eval(chunking)
+    except (ValueError, SyntaxError):
+        # chunking could be 'contiguous', which isn't a literal
         return None
 
-    except NameError:
-        # chunking could be 'contiguous', which doesn't evaluate
+    if var_chunks is None:
         return None
+
+    return tuple(zip(ast.literal_eval(dimensions), var_chunks))
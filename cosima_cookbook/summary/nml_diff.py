@@ -5,27 +5,224 @@
 # Andrew Kiss https://github.com/aekiss
 
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import copy
 import f90nml  # from http://f90nml.readthedocs.io/en/latest/
 import os
+import re
 
+# start of a namelist group, e.g. "&ocean_model_nml" or "$ocean_model_nml"
+_group_start = re.compile(r"[&$](?!end\b)([A-Za-z_]\w*)", re.IGNORECASE)
+# end of a namelist group: "/", "&end" or "$end"
+_group_end = re.compile(r"/|[&$]end\b", re.IGNORECASE)
+# a group member assignment, e.g. "dt_ocean =", "layout(1) =" or "a(1)%b ="
+_member = re.compile(
+    r"([A-Za-z_]\w*(?:\([^)]*\))?(?:%[A-Za-z_]\w*(?:\([^)]*\))?)*)\s*="
+)
+# a value repeated a number of times, e.g. "3*0"
+_repeat = re.compile(r"(\d+)\*(.*)")
+# a logical value, e.g. ".true.", "T" or ".f"
+_logical = re.compile(r"\.?(?:(t)(?:rue)?|f(?:alse)?)\.?", re.IGNORECASE)
+# an integer or real value, e.g. "10", "-5.", "1.0d-3"
+_number = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[deDE][+-]?\d+)?")
 
-def nmldict(nmlfnames):
+# Namelists that have been read, keyed on path and typed (see nmldict)
+_nml_cache = OrderedDict()
+_nml_cache_size = 256
+
+# Number of files, above which nmldict parses them in separate processes
+_process_threshold = 8
+
+
+def _mask_nml(text):
+    """Return (text, mask) for the text of a FORTRAN namelist file.
+
+    Comments are removed from text. mask is the same as text, but with
+    every character of quoted strings replaced by '#', so that delimiters
+    inside strings are ignored when searching the mask.
+    """
+    chars = []
+    mask = []
+    quote = None
+    comment = False
+    for c in text:
+        if comment:
+            if c != "\n":
+                continue
+            comment = False
+        elif quote is not None:
+            if c == quote:
+                quote = None
+            chars.append(c)
+            mask.append("#")
+            continue
+        elif c in "'\"":
+            quote = c
+            chars.append(c)
+            mask.append("#")
+            continue
+        elif c == "!":
+            comment = True
+            continue
+        chars.append(c)
+        mask.append(c)
+
+    return "".join(chars), "".join(mask)
+
+
+def iter_nml_tokens(path):
+    """Yield the group members of a FORTRAN namelist file, without
+        parsing their values.
+
+    Input: namelist file path string
+    Output: generator of (group, member, value) tuples where
+            group and member are lower-case name strings
+            value is the unparsed value string as it appears in the file
+    """
+    with open(path) as f:
+        text, mask = _mask_nml(f.read())
+
+    pos = 0
+    while True:
+        start = _group_start.search(mask, pos)
+        if start is None:
+            return
+        end = _group_end.search(mask, start.end())
+        if end is None:
+            end_pos = pos = len(mask)
+        else:
+            end_pos, pos = end.start(), end.end()
+
+        group = start.group(1).lower()
+        members = list(_member.finditer(mask, start.end(), end_pos))
+        for mem, next_mem in zip(members, members[1:] + [None]):
+            value = text[mem.end() : end_pos if next_mem is None else next_mem.start()]
+            value = re.sub(r"\s*\n\s*", " ", value.strip()).rstrip(",").rstrip()
+            yield group, mem.group(1).lower(), value
+
+
+def _value_key(value):
+    """Return a tuple of the values in an unparsed value string, which is
+    the same however they are written in the file, e.g. for "10,12" and
+    "10, 12", ".true." and "T", "1.0" and "1.", or "'abc'" and '"abc"'.
+    """
+    text, mask = _mask_nml(value)
+    key = []
+    for m in re.finditer(r"[^,\s]+", mask):
+        token = text[m.start() : m.end()]
+        count = 1
+        repeat = _repeat.fullmatch(token)
+        if repeat is not None:
+            count, token = int(repeat.group(1)), repeat.group(2)
+
+        logical = _logical.fullmatch(token)
+        if not token:
+            v = None
+        elif token[0] in "'\"":
+            v = token[1:-1].replace(token[0] * 2, token[0])
+        elif logical is not None:
+            v = logical.group(1) is not None
+        elif _number.fullmatch(token):
+            if token.isdigit() or token[1:].isdigit():
+                v = int(token)
+            else:
+                v = float(token.replace("d", "e").replace("D", "e"))
+        else:
+            v = token
+        key.extend([v] * count)
+    return tuple(key)
+
+
+class _RawValue(str):
+    """An unparsed value string, as it appears in a namelist file, which
+    compares equal to another with the same values written differently
+    (see _value_key)."""
+
+    def __eq__(self, other):
+        if isinstance(other, _RawValue):
+            return _value_key(self) == _value_key(other)
+        return str.__eq__(self, other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash(_value_key(self))
+
+
+def _read_raw(nml):
+    """Return dict of dicts of the unparsed group member values
+    in a namelist file (see iter_nml_tokens)."""
+    groups = {}
+    for group, mem, value in iter_nml_tokens(nml):
+        groups.setdefault(group, {})[mem] = _RawValue(value)
+    return groups
+
+
+def _parse(nml, typed=True):
+    """Return the contents of a namelist file (see nmldict),
+    or None if it doesn't exist."""
+    try:
+        return f90nml.read(nml) if typed else _read_raw(nml)
+    except FileNotFoundError:
+        return None
+
+
+def nmldict(nmlfnames, typed=True):
     """Return dict of the groups/group members of multiple
         FORTRAN namelist files.
 
     Input: tuple of any number of namelist file path strings
             (non-existent files are silently ignored)
+           typed: if False, skip parsing the member values and return
+            them as the strings that appear in the files, which is
+            faster and sufficient for finding differences (values that
+            are only written differently still compare equal)
     Output: dict with key:value pairs where
             key is filename path string
             value is complete Namelist from filename
+            (or dict of dicts of value strings if typed is False)
     """
-    nmlfnames = set(nmlfnames)  # remove any duplicates from nmlfnames
+    nmlfnames = list(set(nmlfnames))  # remove any duplicates from nmlfnames
 
-    nmlall = {}  # dict keys are nml paths, values are Namelist dicts
+    # files are cached on their path, modification time and size, so that
+    # unchanged files are only parsed once per session
+    nmls = {}
+    stamps = {}
     for nml in nmlfnames:
-        if os.path.exists(nml):
-            nmlall[nml] = f90nml.read(nml)
-    return nmlall
+        try:
+            st = os.stat(nml)
+        except FileNotFoundError:
+            continue
+        stamps[nml] = (st.st_mtime_ns, st.st_size)
+        cached = _nml_cache.get((nml, typed))
+        if cached is not None and cached[0] == stamps[nml]:
+            _nml_cache.move_to_end((nml, typed))
+            nmls[nml] = cached[1]
+
+    unread = [nml for nml in stamps if nml not in nmls]
+    workers = min(len(unread), os.cpu_count() or 1)
+    if len(unread) > _process_threshold and workers > 1:
+        # parsing is pure Python, which holds the GIL, so parse the files in
+        # separate processes when there are enough of them to be worth it
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(_parse, unread, [typed] * len(unread)))
+    else:
+        parsed = [_parse(nml, typed) for nml in unread]
+
+    for nml, n in zip(unread, parsed):
+        if n is None:
+            continue
+        nmls[nml] = n
+        _nml_cache[nml, typed] = (stamps[nml], n)
+        if len(_nml_cache) > _nml_cache_size:
+            _nml_cache.popitem(last=False)
+
+    # dict keys are nml paths, values are Namelist dicts; these are copies
+    # of the cached Namelists, which callers such as nmldiff may modify
+    return {nml: copy.deepcopy(n) for nml, n in nmls.items()}
 
 
 def superset(nmlall):
@@ -36,19 +233,14 @@ def superset(nmlall):
             value is Namelist (typically from filename)
     Output: dict with key:value pairs where
         key is group name (including all groups present in any input Namelist)
-        value is Namelist for group (with nothing common to all other files)
+        value is dict of all members of that group in any input Namelist
     """
+    # merge each group's members into a fresh dict as it is first seen,
+    # so the input Namelists are never modified
     nmlsuperset = {}
-    for nml in nmlall:
-        nmlsuperset.update(nmlall[nml])
-    # nmlsuperset now contains all groups that were in any nml
-    for group in nmlsuperset:
-        # to avoid the next bit changing the original groups
-        nmlsuperset[group] = nmlsuperset[group].copy()
-        for nml in nmlall:
-            if group in nmlall[nml]:
-                nmlsuperset[group].update(nmlall[nml][group])
-    # nmlsuperset groups now contain all keys that were in any nml
+    for nml in nmlall.values():
+        for group, members in nml.items():
+            nmlsuperset.setdefault(group, {}).update(members)
     return nmlsuperset
 
 
@@ -68,44 +260,38 @@ def nmldiff(nmlall):
         common to all other files removed
     """
 
+    if len(nmlall) <= 1:
+        # everything in a single file is common to all files
+        for nml in nmlall:
+            nmlall[nml].clear()
+        return nmlall
+
     # Create diff by removing common groups/members from nmlall.
     # This is complicated by the fact group names / member names may differ
     # or be absent across different nml files.
 
-    # First make a superset that has all group names and group members that
-    # appear in any nml file
-    nmlsuperset = superset(nmlall)
+    # Only groups present in every nml file can be common to all of them,
+    # so find those first
+    nmls = list(nmlall.values())
+    common_groups = set.intersection(*(set(nml) for nml in nmls))
 
     # now go through nmlall and remove any groups / members from nmlall that
-    #   are identical to superset in all nmls
+    #   are identical in all nmls
     # first delete any group members that are common to all nmls, then delete
     #   any empty groups common to all nmls
-    for group in nmlsuperset:
-        # init: whether group is present and identical in all namelist files
-        deletegroup = True
-        for nml in nmlall:
-            deletegroup = deletegroup and (group in nmlall[nml])
-        if deletegroup:  # group present in all namelist files
-            for mem in nmlsuperset[group]:
-                # init: whether group member is present and identical
-                #   in all namelist files
-                deletemem = True
-                for nml in nmlall:
-                    deletemem = deletemem and (mem in nmlall[nml][group])
-                if deletemem:  # group member is present in all namelist files
-                    for nml in nmlall:
-                        # ... now check if values match in all namelist files
-                        deletemem = deletemem and (
-                            nmlall[nml][group][mem] == nmlsuperset[group][mem]
-                        )
-                    if deletemem:
-                        for nml in nmlall:
-                            # delete mem from this group in all nmls
-                            del nmlall[nml][group][mem]
-            for nml in nmlall:
-                deletegroup = deletegroup and (len(nmlall[nml][group]) == 0)
-            if deletegroup:
-                # group is common to all nmls and now empty so delete
-                for nml in nmlall:
-                    del nmlall[nml][group]
+    for group in common_groups:
+        groups = [nml[group] for nml in nmls]
+        # likewise only members present in every file can be common
+        common_mems = set.intersection(*(set(g) for g in groups))
+        for mem in common_mems:
+            # check if values match in all namelist files
+            value = groups[0][mem]
+            if all(g[mem] == value for g in groups[1:]):
+                for g in groups:
+                    # delete mem from this group in all nmls
+                    del g[mem]
+        if all(len(g) == 0 for g in groups):
+            # group is common to all nmls and now empty so delete
+            for nml in nmls:
+                del nml[group]
     return nmlall
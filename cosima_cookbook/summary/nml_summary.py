@@ -5,10 +5,10 @@
 # Andrew Kiss https://github.com/aekiss
 
 
-import cosima_cookbook as cc
-from IPython.display import display, Markdown
 import os
 
+from .nml_diff import nmldict, nmldiff, superset
+
 
 def summary_md(
     configuration,
@@ -24,33 +24,49 @@ def summary_md(
         "ocean/input.nml",
     ],
 ):
-    for nml in nmls:
-        epaths = []
-        for e in expts:
-            # NB: only look at output000
-            epaths.append(os.path.join(path, configuration, e, "output000", nml))
-        nmld = cc.nmldiff(cc.nmldict(tuple(epaths)))
-        epaths = list(nmld.keys())  # redefine to handle missing paths
-        epaths.sort()
-        nmldss = cc.superset(nmld)
+    from IPython.display import display, Markdown
+
+    # NB: only look at output000
+    nmlpaths = {
+        nml: [os.path.join(path, configuration, e, "output000", nml) for e in expts]
+        for nml in nmls
+    }
+    # read the files for every namelist together, so they can all be parsed
+    # in parallel; only the value strings are displayed, so skip parsing them
+    nmlall = nmldict(
+        tuple(p for epaths in nmlpaths.values() for p in epaths), typed=False
+    )
+
+    for nml, epaths in nmlpaths.items():
+        nmld = nmldiff({p: nmlall[p] for p in epaths if p in nmlall})
+        epaths = sorted(nmld.keys())  # only the paths that exist
+        nmldss = superset(nmld)
         display(Markdown("### " + nml + " namelist differences"))
         if len(nmldss) == 0:
             display(Markdown("no differences"))
         else:
-            mdstr = "| group | variable | "
-            for e in epaths:
-                mdstr = mdstr + e.replace("/", "/<br>") + " | "
-            mdstr = mdstr + "\n|---|:--|" + ":-:|" * len(epaths)
+            header = "".join(
+                (
+                    "| group | variable | ",
+                    " | ".join(e.replace("/", "/<br>") for e in epaths),
+                    " | \n|---|:--|",
+                    ":-:|" * len(epaths),
+                )
+            )
+            # display a table for each group as soon as it is ready, rather
+            # than building one table for the whole file; the header is
+            # repeated so that each one renders as a table
             for group in sorted(nmldss):
+                # collect the table fragments and join them once at the end
+                parts = [header]
+                # look up this group in each file once, rather than per cell
+                egroups = [nmld[e].get(group, {}) for e in epaths]
                 for mem in sorted(nmldss[group]):
-                    mdstr = mdstr + "\n| " + "&" + group + " | " + mem + " | "
+                    parts.extend(("\n| ", "&", group, " | ", mem, " | "))
                     #                        search doesn't work on github submodules or forks
                     #                        '[' + group + '](' + search + group + ')' + ' | ' + \
                     #                        '[' + mem + '](' + search + mem + ')' + ' | '
-                    for e in epaths:
-                        if group in nmld[e]:
-                            if mem in nmld[e][group]:
-                                mdstr = mdstr + repr(nmld[e][group][mem])
-                        mdstr = mdstr + " | "
-            display(Markdown(mdstr))
+                    for egroup in egroups:
+                        parts.extend((egroup.get(mem, ""), " | "))
+                display(Markdown("".join(parts)))
     return
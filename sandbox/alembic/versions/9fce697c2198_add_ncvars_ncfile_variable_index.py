@@ -0,0 +1,30 @@
+"""add ncvars ncfile/variable index
+
+Optional: databases work with or without this index, so the database version
+is unchanged. New databases are created with it.
+
+Revision ID: 9fce697c2198
+Revises: 16223b92479e
+Create Date: 2026-10-16 11:22:36.557198
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9fce697c2198'
+down_revision = '16223b92479e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the composite index leads with ncfile_id, so it replaces the
+    # single-column index as well as serving variable lookups within a file
+    op.create_index('ix_ncvars_ncfile_id_variable_id', 'ncvars', ['ncfile_id', 'variable_id'])
+    op.drop_index(op.f('ix_ncvars_ncfile_id'), table_name='ncvars')
+
+def downgrade():
+    op.create_index(op.f('ix_ncvars_ncfile_id'), 'ncvars', ['ncfile_id'])
+    op.drop_index('ix_ncvars_ncfile_id_variable_id', table_name='ncvars')
@@ -55,7 +55,7 @@ def test_find_files():
 
     # Test works with alternative suffix
     files = database.find_files("test/", "*.py")
-    assert len(files) == 9
+    assert len(files) == 10
 
     for f in files:
         assert Path(f).suffix == ".py"
@@ -1,9 +1,11 @@
+import shutil
 import warnings
 
 from datetime import datetime
 
 import pytest
 
+from sqlalchemy.orm import sessionmaker
 import xarray as xr
 import pandas as pd
 from pandas.testing import assert_frame_equal, assert_series_equal
@@ -204,6 +206,43 @@ def test_chunk_parsing_unchunked(session):
     assert cc.querying._parse_chunks(var) is None
 
 
+def test_chunk_sizing():
+    # small chunks grow along the outermost dimension, by whole chunks
+    chunks = cc.chunk_utils._sized_chunks(
+        {"time": 1, "st_ocean": 15, "yt_ocean": 216, "xt_ocean": 288}
+    )
+    assert chunks == {"time": 5, "st_ocean": 15, "yt_ocean": 216, "xt_ocean": 288}
+
+    # chunks of a reasonable size are left alone
+    chunks = {"time": 1, "yt_ocean": 2700, "xt_ocean": 3600}
+    assert cc.chunk_utils._sized_chunks(dict(chunks)) == chunks
+
+    # large chunks are split along the outermost dimension
+    chunks = cc.chunk_utils._sized_chunks(
+        {"time": 12, "yt_ocean": 2700, "xt_ocean": 3600}
+    )
+    assert chunks == {"time": 3, "yt_ocean": 2700, "xt_ocean": 3600}
+
+    # chunks of fixed dimensions are kept, and the next dimension is sized
+    chunks = cc.chunk_utils._sized_chunks(
+        {"time": 1, "st_ocean": 15, "yt_ocean": 216, "xt_ocean": 288},
+        fixed={"time": 1},
+    )
+    assert chunks == {"time": 1, "st_ocean": 75, "yt_ocean": 216, "xt_ocean": 288}
+
+    # chunks spanning a whole dimension are of unknown size, so aren't grown
+    chunks = {"time": 1, "st_ocean": None, "yt_ocean": 216, "xt_ocean": 288}
+    assert cc.chunk_utils._sized_chunks(dict(chunks), fixed={"st_ocean"}) == chunks
+
+    assert cc.chunk_utils._sized_chunks(None) is None
+
+
+def test_find_time_coord():
+    assert cc.querying._find_time_coord(("time", "yt_ocean")) == "time"
+    assert cc.querying._find_time_coord(["Time", "lat", "lon"]) == "Time"
+    assert cc.querying._find_time_coord(("yt_ocean", "xt_ocean")) is None
+
+
 def test_get_experiments(session):
     r = cc.querying.get_experiments(session)
 
@@ -636,3 +675,89 @@ def test_query_chunks(session, caplog):
         "querying", "ty_trans", session, chunks={"invalid": 99}
     ) as v:
         assert "chunking along dimensions {'invalid'} is not possible" in caplog.text
+
+
+def test_query_n(session):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", QueryWarning)
+        ncfiles = cc.querying._ncfiles_for_variable("querying", "time", session)
+
+        # the first and last n files match slicing the full query
+        for n in (1, 2, -1, -2):
+            limited = cc.querying._ncfiles_for_variable(
+                "querying", "time", session, n=n
+            )
+            expected = ncfiles[:n] if n > 0 else ncfiles[n:]
+            assert [f.NCFile.ncfile for f in limited] == [
+                f.NCFile.ncfile for f in expected
+            ]
+
+
+def test_query_cache(session):
+    v1 = cc.querying.getvar("querying", "temp", session, decode_times=False, cache=True)
+    v2 = cc.querying.getvar("querying", "temp", session, decode_times=False, cache=True)
+
+    # the underlying data is shared, but attributes are not
+    assert v1.data is v2.data
+    v1.attrs["modified"] = True
+    assert "modified" not in v2.attrs
+
+    # different arguments open the files again
+    v3 = cc.querying.getvar(
+        "querying", "temp", session, decode_times=False, chunks={"time": 1}, cache=True
+    )
+    assert v3.data is not v1.data
+
+
+def test_query_caches_cleared_on_commit(session):
+    cc.querying.getvar("querying", "temp", session, decode_times=False)
+    caches = session.info[cc.querying._session_cache_key]
+    assert caches["unique_attrs"]
+    assert caches["experiment_metadata"]
+
+    session.commit()
+    assert not session.info.get(cc.querying._session_cache_key)
+
+    # caches of other sessions in the process aren't affected
+    other = sessionmaker(bind=session.get_bind())()
+    cc.querying.getvar("querying", "temp", other, decode_times=False)
+    session.commit()
+    assert other.info[cc.querying._session_cache_key]
+
+
+def test_query_time_range(session):
+    # the file covers years 166 and 167, so only part of it is within range
+    v = cc.querying.getvar("querying", "ty_trans", session)
+    assert v.sizes["time"] == 2
+
+    v = cc.querying.getvar("querying", "ty_trans", session, start_time="0167-01-01")
+    assert v.sizes["time"] == 1
+    assert v.time.dt.year.values.tolist() == [167]
+
+    v = cc.querying.getvar("querying", "ty_trans", session, end_time="0166-12-31")
+    assert v.time.dt.year.values.tolist() == [166]
+
+    # times can't be selected without decoding them
+    v = cc.querying.getvar(
+        "querying", "ty_trans", session, start_time="0167-01-01", decode_times=False
+    )
+    assert v.sizes["time"] == 2
+
+
+def test_query_overlapping_times(tmp_path):
+    session = cc.database.create_session(str(tmp_path / "test.db"))
+    for run in ("output000", "output001"):
+        (tmp_path / "overlap" / run).mkdir(parents=True)
+        shutil.copy(
+            "test/data/querying/restart000/ty_trans.nc", tmp_path / "overlap" / run
+        )
+    cc.database.build_index(str(tmp_path / "overlap"), session)
+
+    # files covering the same times can't be concatenated in order
+    with pytest.raises(ValueError):
+        cc.querying.getvar("overlap", "ty_trans", session)
+
+    v = cc.querying.getvar("overlap", "ty_trans", session, n=1)
+    assert v.attrs["ncfiles"][0].endswith("output000/ty_trans.nc")
+    v = cc.querying.getvar("overlap", "ty_trans", session, n=-1)
+    assert v.attrs["ncfiles"][0].endswith("output001/ty_trans.nc")
@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+import IPython.display
+
+from cosima_cookbook.summary import nml_diff, nml_summary
+
+nmls = tuple(
+    f"test/data/summary/config/{e}/output000/ocean/input.nml" for e in ("a", "b")
+)
+
+
+def test_nml_tokens():
+    tokens = list(nml_diff.iter_nml_tokens(nmls[0]))
+
+    assert tokens == [
+        ("ocean_model_nml", "dt_ocean", "1800"),
+        ("ocean_model_nml", "layout", "10, 12"),
+        ("ocean_model_nml", "restart_output_dir", "'RESTART/a!b'"),
+        ("ocean_tracer_nml", "zero_tendency", ".false."),
+        ("ocean_tracer_nml", "t_min", "-5.0"),
+        ("ocean_tracer_nml", "t_max", "100.0"),
+        ("ocean_tracer_nml", "debug_this_module", ".true."),
+    ]
+
+
+def test_nml_tokens_derived_type(tmp_path):
+    path = tmp_path / "input.nml"
+    path.write_text("&a_nml\n  a(1)%b = 1, c%d(2)%e = 'x'\n  f = 2\n/\n")
+
+    assert list(nml_diff.iter_nml_tokens(str(path))) == [
+        ("a_nml", "a(1)%b", "1"),
+        ("a_nml", "c%d(2)%e", "'x'"),
+        ("a_nml", "f", "2"),
+    ]
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_nmldiff_spelling(tmp_path, typed):
+    # the same values, written differently, aren't differences
+    paths = (str(tmp_path / "a.nml"), str(tmp_path / "b.nml"))
+    with open(paths[0], "w") as f:
+        f.write("&a_nml\n  w = 10,12\n  x = .true.\n  y = 1.0\n  z = 'abc'\n")
+        f.write("  n = 3*0\n  d = 2\n/\n")
+    with open(paths[1], "w") as f:
+        f.write('&a_nml\n  w = 10, 12\n  x = T\n  y = 1.\n  z = "abc"\n')
+        f.write("  n = 0, 0, 0\n  d = 3\n/\n")
+
+    nmld = nml_diff.nmldiff(nml_diff.nmldict(paths, typed=typed))
+    for path in paths:
+        assert set(nmld[path]["a_nml"]) == {"d"}
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_nmldiff(typed):
+    nmld = nml_diff.nmldiff(nml_diff.nmldict(nmls + ("missing.nml",), typed=typed))
+
+    assert set(nmld) == set(nmls)
+    assert set(nml_diff.superset(nmld)) == {"ocean_model_nml", "ocean_tracer_nml"}
+
+    for nml in nmls:
+        assert set(nmld[nml]["ocean_model_nml"]) == {"dt_ocean"}
+
+    assert len(nmld[nmls[0]]["ocean_tracer_nml"]) == 0
+    assert set(nmld[nmls[1]]["ocean_tracer_nml"]) == {"extra"}
+
+
+def test_summary_md(monkeypatch):
+    displayed = []
+    monkeypatch.setattr(IPython.display, "display", displayed.append)
+
+    nml_summary.summary_md(
+        "config",
+        ["a", "b", "missing"],
+        path="test/data/summary",
+        nmls=["ocean/input.nml", "ice/input_ice.nml"],
+    )
+
+    md = [d.data for d in displayed]
+    assert md[0] == "### ocean/input.nml namelist differences"
+    header = [
+        "| group | variable | "
+        + " | ".join(p.replace("/", "/<br>") for p in nmls)
+        + " | ",
+        "|---|:--|:-:|:-:|",
+    ]
+    assert md[1].splitlines() == header + [
+        "| &ocean_model_nml | dt_ocean | 1800 | 1200 | ",
+    ]
+    assert md[2].splitlines() == header + [
+        '| &ocean_tracer_nml | extra |  | "a / b" | ',
+    ]
+    assert md[3:] == ["### ice/input_ice.nml namelist differences", "no differences"]
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_nmldiff_single(typed):
+    nmld = nml_diff.nmldict(nmls[:1], typed=typed)
+    assert set(nml_diff.superset(nmld)) == {"ocean_model_nml", "ocean_tracer_nml"}
+
+    nmld = nml_diff.nmldiff(nmld)
+    assert len(nmld[nmls[0]]) == 0
+    assert nml_diff.superset(nmld) == {}
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_nmldict_many(tmp_path, typed):
+    paths = nmls + (str(tmp_path / "input.nml"),)
+    (tmp_path / "input.nml").write_text(open(nmls[0]).read())
+
+    nmld = nml_diff.nmldict(paths + ("missing.nml",), typed=typed)
+    assert set(nmld) == set(paths)
+    assert nmld[paths[2]] == nml_diff.nmldict(nmls[:1], typed=typed)[nmls[0]]
+
+
+@pytest.mark.parametrize("typed", [True, False])
+def test_nmldict_processes(tmp_path, monkeypatch, typed):
+    monkeypatch.setattr(nml_diff, "_process_threshold", 1)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+
+    paths = nmls + (str(tmp_path / "input.nml"),)
+    (tmp_path / "input.nml").write_text(open(nmls[0]).read())
+
+    nmld = nml_diff.nmldict(paths + ("missing.nml",), typed=typed)
+    assert set(nmld) == set(paths)
+    assert nmld[paths[2]] == nmld[nmls[0]]
+
+
+def test_nmldict_cached(tmp_path):
+    path = tmp_path / "input.nml"
+    path.write_text("&a_nml\n  x = 1\n/\n")
+
+    nmld = nml_diff.nmldict((str(path),))
+    nml_diff.nmldiff(nmld)
+    # nmldiff modifies its input, which mustn't affect later reads
+    assert nml_diff.nmldict((str(path),))[str(path)] == {"a_nml": {"x": 1}}
+
+    # changed files are read again
+    path.write_text("&a_nml\n  x = 2, y = 3\n/\n")
+    assert nml_diff.nmldict((str(path),))[str(path)] == {"a_nml": {"x": 2, "y": 3}}